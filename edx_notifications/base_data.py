@@ -7,12 +7,57 @@ Base objects that data.py uses
 import copy
 import json
 import inspect
+from enum import Enum
+from uuid import UUID
+from math import isfinite
+from functools import lru_cache
 from datetime import datetime, timedelta
 
 import six
 import dateutil.parser
 from freezegun.api import FakeDatetime
 
+try:
+    # orjson is an optional (much faster) drop in for the stdlib json module,
+    # install it with the 'orjson' extra
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _needs_json_module(value):
+    """
+    Returns True if the passed in dict/list/tuple holds anything which orjson
+    might serialize differently from the json module: non-finite floats (which
+    orjson writes as null), UUIDs and Enums (which json rejects, or writes
+    differently), and non-string dict keys (which are rare, so leave all of
+    the key conversion rules to json)
+    """
+
+    if isinstance(value, dict):
+        for key in value:
+            if type(key) is not str:  # pylint: disable=unidiomatic-typecheck
+                return True
+        value = value.values()
+
+    for item in value:
+        # this is called for every dict we serialize, so check for the
+        # common exact types before falling back to isinstance()
+        item_type = type(item)
+        if item_type is str or item_type is int or item_type is bool or item is None:
+            continue
+
+        if isinstance(item, float):
+            if not isfinite(item):
+                return True
+        elif isinstance(item, (dict, list, tuple)):
+            if _needs_json_module(item):
+                return True
+        elif isinstance(item, (UUID, Enum)):
+            return True
+
+    return False
+
 
 class DateTimeWithDeltaCompare(datetime):
     """
@@ -178,6 +223,25 @@ class DictField(TypedField):
                 "Could not provide JSON serializer for type {name}!".format(name=type(obj))
             )
 
+        # make sure the same values are accepted, and stored the same way,
+        # with or without orjson installed
+        if orjson and not _needs_json_module(data):
+            try:
+                # have orjson hand date/time types and dataclasses to
+                # datetime_to_json() as well, just like the json module does
+                return orjson.dumps(
+                    data,
+                    default=datetime_to_json,
+                    option=(
+                        orjson.OPT_NON_STR_KEYS |
+                        orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS
+                    )
+                ).decode('utf-8')
+            except orjson.JSONEncodeError:
+                # e.g. integers wider than 64 bits, let the json module decide
+                pass
+
         return json.dumps(data, default=datetime_to_json)
 
     @classmethod
@@ -189,7 +253,15 @@ class DictField(TypedField):
         if not _value:
             return None
 
-        _dict = json.loads(_value)
+        if orjson:
+            try:
+                _dict = orjson.loads(_value)
+            except orjson.JSONDecodeError:
+                # orjson is stricter, e.g. NaN/Infinity which the
+                # stdlib json module will happily write out
+                _dict = json.loads(_value)
+        else:
+            _dict = json.loads(_value)
 
         for key, value in _dict.items():
             if isinstance(value, str):
@@ -272,6 +344,27 @@ class BaseDataObjectMetaClass(type):
         return super().__new__(mcs, name, bases, attrs)
 
 
+@lru_cache(maxsize=None)
+def _get_field_names(cls):
+    """
+    Returns the names of all of the TypedFields on a DataObject class. The schema
+    of a DataObject is fixed at design time, so only introspect each class once
+    """
+
+    return tuple(
+        attr_name for attr_name, __ in inspect.getmembers(cls, lambda attr: isinstance(attr, TypedField))
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_attribute_names(cls):
+    """
+    Returns the names of all attributes which can be set on a DataObject class
+    """
+
+    return frozenset(dir(cls))
+
+
 class BaseDataObject(metaclass=BaseDataObjectMetaClass):
     """
     A base class for all Notification Data Objects
@@ -287,7 +380,7 @@ class BaseDataObject(metaclass=BaseDataObjectMetaClass):
 
         for key in kwargs:
             value = kwargs[key]
-            if key in dir(self):
+            if key in _get_attribute_names(self.__class__):
                 setattr(self, key, value)
             else:
                 raise ValueError(
@@ -304,7 +397,7 @@ class BaseDataObject(metaclass=BaseDataObjectMetaClass):
         We want our data models to have a schema that is fixed as design time!!!
         """
 
-        if attribute != '_field_data' and attribute not in dir(self):
+        if attribute != '_field_data' and attribute not in _get_attribute_names(self.__class__):
             raise ValueError(
                 (
                     "Attempting to add a new attribute '{name}' that was not part of "
@@ -357,7 +450,7 @@ class BaseDataObject(metaclass=BaseDataObjectMetaClass):
         """
 
         instance = cls()
-        for attr_name, __ in inspect.getmembers(cls, lambda attr: isinstance(attr, TypedField)):
+        for attr_name in _get_field_names(cls):
             if hasattr(src, attr_name):
                 val = getattr(src, attr_name)
                 # when cloning a dict, make a copy
@@ -375,7 +468,7 @@ class BaseDataObject(metaclass=BaseDataObjectMetaClass):
         """
 
         _dict = {}
-        for attr_name, __ in inspect.getmembers(self.__class__, lambda attr: isinstance(attr, TypedField)):
+        for attr_name in _get_field_names(self.__class__):
             value = getattr(self, attr_name)
             if isinstance(value, BaseDataObject):
                 _dict[attr_name] = value.get_fields()
@@ -390,7 +483,7 @@ class BaseDataObject(metaclass=BaseDataObjectMetaClass):
         """
 
         _dict = {}
-        for attr_name, __ in inspect.getmembers(self.__class__, lambda attr: isinstance(attr, TypedField)):
+        for attr_name in _get_field_names(self.__class__):
             value = getattr(self, attr_name)
 
             if isinstance(value, BaseDataObject):
@@ -27,6 +27,12 @@ RENDER_FORMAT_JSON = 'json'
 
 NOTIFICATION_BULK_PUBLISH_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_BULK_PUBLISH_CHUNK_SIZE', 100)
 NOTIFICATION_MINIMUM_PERIODICITY_MINS = getattr(settings, 'NOTIFICATION_MINIMUM_PERIODICITY_MINS', 60)  # hourly
+NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE', 500)
+NOTIFICATION_TIMER_FETCH_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_TIMER_FETCH_CHUNK_SIZE', 200)
+
+# number of threads used to run timer callbacks concurrently, 1 means run them
+# one after another in the calling thread
+NOTIFICATION_TIMER_WORKERS = getattr(settings, 'NOTIFICATION_TIMER_WORKERS', 1)
 
 NOTIFICATION_PURGE_READ_OLDER_THAN_DAYS = getattr(settings, 'NOTIFICATION_PURGE_READ_OLDER_THAN_DAYS', None)
 NOTIFICATION_PURGE_UNREAD_OLDER_THAN_DAYS = getattr(settings, 'NOTIFICATION_PURGE_UNREAD_OLDER_THAN_DAYS', None)
@@ -0,0 +1,47 @@
+from django.db import migrations
+import edx_notifications.stores.sql.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_notifications', '0002_auto_20170221_0255'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sqlnotificationcallbacktimer',
+            name='context',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='sqlnotificationcallbacktimer',
+            name='results',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='sqlnotificationmessage',
+            name='payload',
+            field=edx_notifications.stores.sql.models.DictTextField(),
+        ),
+        migrations.AlterField(
+            model_name='sqlnotificationmessage',
+            name='resolve_links',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='sqlnotificationtype',
+            name='renderer_context',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='sqlusernotification',
+            name='user_context',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='sqlusernotificationarchive',
+            name='user_context',
+            field=edx_notifications.stores.sql.models.DictTextField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_notifications', '0003_dict_text_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sqlnotificationcallbacktimer',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='sqlnotificationcallbacktimer',
+            index=models.Index(fields=['is_active', 'callback_at'], name='idx_timer_active_at'),
+        ),
+    ]
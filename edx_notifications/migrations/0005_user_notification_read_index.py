@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_notifications', '0004_timer_active_callback_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sqlusernotification',
+            name='user_id',
+            field=models.IntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='sqlusernotification',
+            index=models.Index(fields=['user_id', 'read_at'], name='idx_user_read_at'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_notifications', '0005_user_notification_read_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sqlusernotification',
+            index=models.Index(fields=['user_id', '-created'], name='idx_user_created'),
+        ),
+    ]
@@ -4,10 +4,14 @@ Django ORM models to support the Notification Store SQL backend
 
 
 
+import threading
+
+import pylru
 from model_utils.models import TimeStampedModel
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ObjectDoesNotExist
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete
 
 from edx_notifications import const
 from edx_notifications.data import (
@@ -21,6 +25,76 @@ from edx_notifications.data import (
 from edx_notifications.base_data import DictField
 
 
+class DictTextField(models.TextField):
+    """
+    A TextField which stores a dict as a JSON string. The value is decoded
+    once as it is read from the database, so ORM instances always expose a
+    dict and the to/from data object conversions can simply copy it across
+    """
+
+    def from_db_value(self, value, expression, connection):  # pylint: disable=unused-argument
+        """
+        Convert the JSON string stored in the database into a dict
+        """
+
+        return DictField.from_json(value)
+
+    def to_python(self, value):
+        """
+        Convert any JSON string (e.g. from a fixture) into a dict
+        """
+
+        if isinstance(value, str):
+            return DictField.from_json(value)
+
+        return value
+
+    @staticmethod
+    def normalize(value):
+        """
+        Returns a copy of the dict as it would be read back from the database
+        """
+
+        if isinstance(value, dict):
+            return DictField.from_json(DictField.to_json(value))
+
+        return value
+
+    def pre_save(self, model_instance, add):
+        """
+        Serialize the dict once as the instance is written, and replace the
+        instance's value with what we would read back from the database. This
+        way the instance never holds on to the caller's dict, and a save hands
+        back the same data that a load would
+        """
+
+        value = super().pre_save(model_instance, add)
+
+        if isinstance(value, dict):
+            value = DictField.to_json(value)
+            setattr(model_instance, self.attname, DictField.from_json(value))
+
+        return value
+
+    def get_prep_value(self, value):
+        """
+        Serialize a dict into its JSON string for storage
+        """
+
+        if isinstance(value, dict):
+            return DictField.to_json(value)
+
+        return value
+
+    def value_to_string(self, obj):
+        """
+        Serialize the dict as JSON (e.g. for dumpdata) so that
+        to_python() can read it back in
+        """
+
+        return DictField.to_json(self.value_from_object(obj))
+
+
 class SQLNotificationType(models.Model):
     """
     Notification Type information
@@ -33,7 +107,18 @@ class SQLNotificationType(models.Model):
     renderer = models.CharField(max_length=255)
 
     # any context to pass into the above renderer
-    renderer_context = models.TextField(null=True)
+    renderer_context = DictTextField(null=True)
+
+    # NotificationTypes are supposed to be immutable during the process
+    # lifetime, so keep the data objects we build from database rows around
+    # rather than re-reading them for every message we hydrate. Data objects
+    # are mutable, so we keep private copies and only ever hand out clones. The
+    # store provider sizes this with its MAX_MSG_TYPE_CACHE_SIZE setting
+    _data_object_cache = pylru.lrucache(1024)
+
+    # timer callbacks can hydrate messages on a pool of worker threads, and
+    # pylru is not thread safe (even lookups relink its entries)
+    _data_object_cache_lock = threading.Lock()
 
     class Meta:
         """
@@ -47,12 +132,106 @@ class SQLNotificationType(models.Model):
         Generate a NotificationType data object
         """
 
-        return NotificationType(
+        # only rows which were read from the database are cached, unsaved
+        # instances might not reflect what is actually stored
+        from_db = not self._state.adding
+
+        if from_db:
+            cached = self._get_cached_data_object(self.name)
+            if cached is not None:
+                return cached
+
+        data_object = NotificationType(
             name=self.name,
             renderer=self.renderer,
-            renderer_context=DictField.from_json(self.renderer_context)
+            # an unsaved instance still holds the caller's dict
+            renderer_context=(
+                self.renderer_context if from_db else DictTextField.normalize(self.renderer_context)
+            )
         )
 
+        if from_db:
+            self._cache_data_object(data_object)
+
+        return data_object
+
+    @classmethod
+    def _cache_data_object(cls, data_object):
+        """
+        Add a NotificationType data object to the cache. The row it was built from
+        might not have been committed yet, and the transaction could still be rolled
+        back, so only do this once it has been (right away when not in a transaction)
+        """
+
+        # keep our own copy, the caller is free to change what it got
+        data_object = NotificationType.clone(data_object)
+
+        def _cache():
+            """
+            Actually add the data object to the cache
+            """
+            with cls._data_object_cache_lock:
+                cls._data_object_cache[data_object.name] = data_object
+
+        transaction.on_commit(_cache)
+
+    @classmethod
+    def _get_cached_data_object(cls, name):
+        """
+        Returns a clone of the cached NotificationType data object with the
+        given name, or None if it isn't cached
+        """
+
+        with cls._data_object_cache_lock:
+            if name not in cls._data_object_cache:
+                return None
+            data_object = cls._data_object_cache[name]
+
+        return NotificationType.clone(data_object)
+
+    @classmethod
+    def get_data_object(cls, name):
+        """
+        Returns the NotificationType data object with the given name, served from
+        the in-process cache whenever possible
+        """
+
+        cached = cls._get_cached_data_object(name)
+        if cached is not None:
+            return cached
+
+        # there are only a handful of types, so fill the cache with all of them
+        data_object = None
+        for obj in cls.objects.all():
+            if obj.name == name:
+                data_object = obj.to_data_object()
+            else:
+                obj.to_data_object()
+
+        if data_object is None:
+            raise ObjectDoesNotExist(f"Could not find SQLNotificationType with name '{name}'")
+
+        return data_object
+
+    @classmethod
+    def set_data_object_cache_size(cls, size):
+        """
+        Change the maximum number of NotificationType data objects we keep around
+        """
+
+        with cls._data_object_cache_lock:
+            cls._data_object_cache.size(size)
+
+    @classmethod
+    def invalidate_cached_data_object(cls, name):
+        """
+        Drop any cached NotificationType data object for the given name
+        """
+
+        with cls._data_object_cache_lock:
+            if name in cls._data_object_cache:
+                del cls._data_object_cache[name]
+
     @classmethod
     def from_data_object(cls, msg_type):
         """
@@ -70,7 +249,7 @@ class SQLNotificationType(models.Model):
 
         self.name = msg_type.name  # pylint: disable=attribute-defined-outside-init
         self.renderer = msg_type.renderer
-        self.renderer_context = DictField.to_json(msg_type.renderer_context)
+        self.renderer_context = msg_type.renderer_context
 
 
 class SQLNotificationMessage(TimeStampedModel):
@@ -89,7 +268,7 @@ class SQLNotificationMessage(TimeStampedModel):
     from_user_id = models.IntegerField(null=True)
 
     # the actual data which will be used in rendering the notification
-    payload = models.TextField()
+    payload = DictTextField()
 
     # delivery/expiration times
     deliver_no_earlier_than = models.DateTimeField(null=True)
@@ -98,7 +277,7 @@ class SQLNotificationMessage(TimeStampedModel):
 
     priority = models.IntegerField(default=const.NOTIFICATION_PRIORITY_NONE)
 
-    resolve_links = models.TextField(null=True)
+    resolve_links = DictTextField(null=True)
 
     object_id = models.CharField(max_length=255, db_index=True, null=True)
 
@@ -115,17 +294,33 @@ class SQLNotificationMessage(TimeStampedModel):
         Return a Notification Message data object
         """
 
+        # the msg_type FK column already holds the type name, so unless the type row
+        # was joined in (or explicitly set) resolve it from the in-process cache
+        if SQLNotificationMessage.msg_type.is_cached(self):
+            msg_type = self.msg_type.to_data_object()
+        else:
+            msg_type = SQLNotificationType.get_data_object(self.msg_type_id)
+
+        payload = self.payload
+        resolve_links = self.resolve_links
+        if self._state.adding:
+            # this instance was never read from or written to the database (e.g. the
+            # message a new SQLUserNotification points at), so it still holds the
+            # caller's dicts
+            payload = DictTextField.normalize(payload)
+            resolve_links = DictTextField.normalize(resolve_links)
+
         msg = NotificationMessage(
             id=self.id,
             namespace=self.namespace,
-            msg_type=self.msg_type.to_data_object(),
+            msg_type=msg_type,
             from_user_id=self.from_user_id,
             deliver_no_earlier_than=self.deliver_no_earlier_than,
             expires_at=self.expires_at,
             expires_secs_after_read=self.expires_secs_after_read,
-            payload=DictField.from_json(self.payload),  # special case, dict<-->JSON string
+            payload=payload,
             created=self.created,
-            resolve_links=DictField.from_json(self.resolve_links),  # special case, dict<-->JSON string
+            resolve_links=resolve_links,
             object_id=self.object_id
         )
 
@@ -158,8 +353,8 @@ class SQLNotificationMessage(TimeStampedModel):
         self.deliver_no_earlier_than = msg.deliver_no_earlier_than
         self.expires_at = msg.expires_at
         self.expires_secs_after_read = msg.expires_secs_after_read
-        self.payload = DictField.to_json(msg.payload)
-        self.resolve_links = DictField.to_json(msg.resolve_links)
+        self.payload = msg.payload
+        self.resolve_links = msg.resolve_links
         self.object_id = msg.object_id
 
 
@@ -175,7 +370,7 @@ class SQLUserNotificationArchive(TimeStampedModel):
 
     read_at = models.DateTimeField(null=True, db_index=True)
 
-    user_context = models.TextField(null=True)
+    user_context = DictTextField(null=True)
 
     class Meta:
         """
@@ -192,13 +387,13 @@ class SQLUserNotification(TimeStampedModel):
     Information about how a Notification is tied to a targeted user, and related state (e.g. read/unread)
     """
 
-    user_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField()
 
     msg = models.ForeignKey(SQLNotificationMessage, db_index=True, on_delete=models.CASCADE)
 
     read_at = models.DateTimeField(null=True, db_index=True)
 
-    user_context = models.TextField(null=True)
+    user_context = DictTextField(null=True)
 
     class Meta:
         """
@@ -208,6 +403,13 @@ class SQLUserNotification(TimeStampedModel):
         db_table = 'edx_notifications_usernotification'
         unique_together = (('user_id', 'msg'),)  # same user should not get the same notification twice
         ordering = ['-created']  # default order is most recent one should be read first
+        indexes = [
+            # serves the per user read/unread queries, e.g. the unread count. This
+            # also covers any lookup on user_id alone
+            models.Index(fields=['user_id', 'read_at'], name='idx_user_read_at'),
+            # serves a user's inbox page, which is sorted by the default ordering
+            models.Index(fields=['user_id', '-created'], name='idx_user_created'),
+        ]
 
     def to_data_object(self, options=None):  # pylint: disable=unused-argument
         """
@@ -219,7 +421,7 @@ class SQLUserNotification(TimeStampedModel):
             user_id=self.user_id,
             msg=self.msg.to_data_object(),  # pylint: disable=no-member
             read_at=self.read_at,
-            user_context=DictField.from_json(self.user_context),
+            user_context=self.user_context,
             created=self.created
         )
 
@@ -242,7 +444,36 @@ class SQLUserNotification(TimeStampedModel):
         self.user_id = user_msg.user_id
         self.msg = SQLNotificationMessage.from_data_object(user_msg.msg)
         self.read_at = user_msg.read_at
-        self.user_context = DictField.to_json(user_msg.user_context)
+        self.user_context = user_msg.user_context
+
+    @classmethod
+    def bulk_from_data_objects(cls, user_msgs):
+        """
+        Create a list of (unsaved) ORM model objects from a list of UserNotifications,
+        suitable for passing into bulk_create(). A fan-out points many UserNotifications
+        at the same NotificationMessage, so each distinct message is only hydrated
+        (and validated) once
+        """
+
+        sql_msgs = {}
+        objs = []
+        for user_msg in user_msgs:
+            # keep primary keys and (unsaved) object identities apart
+            msg_key = ('pk', user_msg.msg.id) if user_msg.msg.id else ('obj', id(user_msg.msg))
+            if msg_key not in sql_msgs:
+                sql_msgs[msg_key] = SQLNotificationMessage.from_data_object(user_msg.msg)
+
+            objs.append(
+                SQLUserNotification(
+                    id=user_msg.id,
+                    user_id=user_msg.user_id,
+                    msg=sql_msgs[msg_key],
+                    read_at=user_msg.read_at,
+                    user_context=user_msg.user_context
+                )
+            )
+
+        return objs
 
 
 class SQLNotificationChannel(models.Model):
@@ -373,18 +604,22 @@ class SQLNotificationCallbackTimer(TimeStampedModel):
         """
         app_label = 'edx_notifications'  # since we have this models.py file not in the root app directory
         db_table = 'edx_notifications_notificationcallbacktimer'
+        indexes = [
+            # serves the poll for active timers which are due to fire
+            models.Index(fields=['is_active', 'callback_at'], name='idx_timer_active_at'),
+        ]
 
     # the internal name is the primary key
     name = models.CharField(primary_key=True, max_length=255)
 
     callback_at = models.DateTimeField(db_index=True)
     class_name = models.CharField(max_length=255)
-    context = models.TextField(null=True)
-    is_active = models.BooleanField(db_index=True, default=True)
+    context = DictTextField(null=True)
+    is_active = models.BooleanField(default=True)
     periodicity_min = models.IntegerField(null=True)
     executed_at = models.DateTimeField(null=True)
     err_msg = models.TextField(null=True)
-    results = models.TextField(null=True)
+    results = DictTextField(null=True)
 
     def to_data_object(self, options=None):  # pylint: disable=unused-argument
         """
@@ -395,14 +630,14 @@ class SQLNotificationCallbackTimer(TimeStampedModel):
             name=self.name,
             callback_at=self.callback_at,
             class_name=self.class_name,
-            context=DictField.from_json(self.context),  # special case, dict<-->JSON string
+            context=self.context,
             is_active=self.is_active,
             periodicity_min=self.periodicity_min,  # pylint: disable=no-member
             executed_at=self.executed_at,
             err_msg=self.err_msg,
             created=self.created,
             modified=self.modified,
-            results=DictField.from_json(self.results)
+            results=self.results
         )
 
     @classmethod
@@ -423,12 +658,32 @@ class SQLNotificationCallbackTimer(TimeStampedModel):
         self.name = notification_timer.name  # pylint: disable=attribute-defined-outside-init
         self.callback_at = notification_timer.callback_at
         self.class_name = notification_timer.class_name
-        self.context = DictField.to_json(notification_timer.context)
+        self.context = notification_timer.context
         self.is_active = notification_timer.is_active
         self.periodicity_min = notification_timer.periodicity_min
         self.executed_at = notification_timer.executed_at
         self.err_msg = notification_timer.err_msg
-        self.results = DictField.to_json(notification_timer.results)
+        self.results = notification_timer.results
+
+
+@receiver(post_save, sender=SQLNotificationType)
+def refresh_notification_type_cache(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Make sure we don't hand out stale NotificationTypes once they have been changed
+    """
+    SQLNotificationType.invalidate_cached_data_object(instance.name)
+
+    # the instance is now in sync with the database, so this will re-cache it
+    # (once the transaction it was saved in has been committed)
+    instance.to_data_object()
+
+
+@receiver(post_delete, sender=SQLNotificationType)
+def invalidate_notification_type_cache(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Make sure we don't hand out NotificationTypes once they have been deleted
+    """
+    SQLNotificationType.invalidate_cached_data_object(instance.name)
 
 
 @receiver(pre_delete, sender=SQLUserNotification)
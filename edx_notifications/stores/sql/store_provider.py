@@ -8,8 +8,7 @@ import copy
 from datetime import datetime
 
 import pytz
-import pylru
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.core.exceptions import ObjectDoesNotExist
 
 from edx_notifications import const
@@ -40,22 +39,17 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         """
 
         _msg_type_cache_size = kwargs.get('MAX_MSG_TYPE_CACHE_SIZE', 1024)
-        self._msg_type_cache = pylru.lrucache(_msg_type_cache_size)
+        SQLNotificationType.set_data_object_cache_size(_msg_type_cache_size)
 
     def _get_notification_by_id(self, msg_id, options=None):
         """
         Helper method to get Notification Message by id
         """
 
-        # pylint/pep8 seem to complain if defaults are set to empty dicts
-        _options = options if options else {}
-        select_related = _options.get('select_related', True)
-
+        # no need to JOIN the NotificationType (regardless of the 'select_related'
+        # option), it is served from the in-process cache
         try:
-            query = SQLNotificationMessage.objects
-            if select_related:
-                query = query.select_related()
-            obj = query.get(id=msg_id)
+            obj = SQLNotificationMessage.objects.get(id=msg_id)
         except ObjectDoesNotExist:
             raise ItemNotFoundError()
 
@@ -98,23 +92,11 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         Therefore we can memoize this function
         """
 
-        data_object = None
-        # pull from the cache, if we have it
-        if name in self._msg_type_cache:
-            data_object = self._msg_type_cache[name]
-            return data_object
-
         try:
-            obj = SQLNotificationType.objects.get(name=name)
+            return SQLNotificationType.get_data_object(name)
         except ObjectDoesNotExist:
             raise ItemNotFoundError()
 
-        data_object = obj.to_data_object()
-
-        # refresh the cache
-        self._msg_type_cache[name] = data_object
-        return data_object
-
     def get_all_notification_types(self):  # pylint: disable=no-self-use
         """
         This returns a NotificationType object.
@@ -150,9 +132,6 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
             except IntegrityError:  # pylint: disable=catching-non-exception
                 pass
 
-        # remove cached entry
-        if msg_type.name in self._msg_type_cache:
-            del self._msg_type_cache[msg_type.name]
         return msg_type
 
     def _get_prepaged_notifications(self, user_id, filters=None, options=None):
@@ -180,8 +159,9 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
 
         query = SQLUserNotification.objects.filter(user_id=user_id)
 
+        # NotificationTypes are resolved from an in-process cache, so only join the message
         if select_related:
-            query = query.select_related()
+            query = query.select_related('msg')
 
         if namespace:
             query = query.filter(msg__namespace=namespace)
@@ -256,7 +236,7 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         Get a single UserNotification for the user_id/msg_id pair
         """
         try:
-            item = SQLUserNotification.objects.select_related().get(user_id=user_id, msg_id=msg_id)
+            item = SQLUserNotification.objects.select_related('msg').get(user_id=user_id, msg_id=msg_id)
             return item.to_data_object()
         except ObjectDoesNotExist:
             msg = (
@@ -349,6 +329,7 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
               that was created will not be returned (limitation of Django ORM)
 
         NOTE: This method cannot update existing UserNotifications, only create them.
+              Any user_msg which would duplicate an existing user_id/msg pair is skipped.
         NOTE: It is assumed that user_msgs is already chunked in an appropriate size.
         """
 
@@ -359,11 +340,15 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
             )
             raise BulkOperationTooLarge(msg)
 
-        objs = []
-        for user_msg in user_msgs:
-            objs.append(SQLUserNotification.from_data_object(user_msg))
+        objs = SQLUserNotification.bulk_from_data_objects(user_msgs)
 
-        SQLUserNotification.objects.bulk_create(objs, batch_size=const.NOTIFICATION_BULK_PUBLISH_CHUNK_SIZE)
+        # rely on the unique (user_id, msg) constraint to drop any duplicates
+        # rather than checking for existing rows one at a time
+        SQLUserNotification.objects.bulk_create(
+            objs,
+            batch_size=const.NOTIFICATION_BULK_PUBLISH_CHUNK_SIZE,
+            ignore_conflicts=True
+        )
 
     def save_notification_timer(self, timer):
         """
@@ -385,6 +370,51 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         obj.save()
         return obj.to_data_object()
 
+    def bulk_update_notification_timers(self, timers, update_fields):
+        """
+        Will update a batch of existing NotificationCallbackTimers, writing just
+        the columns in update_fields. This issues one UPDATE statement per
+        NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE timers, all in one transaction
+        """
+
+        if not timers:
+            return
+
+        # bulk_update() does not call pre_save() so we need to bump 'modified' ourselves
+        modified = datetime.now(pytz.UTC)
+
+        objs = []
+        for timer in timers:
+            obj = SQLNotificationCallbackTimer.from_data_object(timer)
+            obj.modified = modified
+            objs.append(obj)
+
+        # when every timer gets the same values (e.g. marking a batch as executed)
+        # a plain UPDATE ... WHERE id IN (...) does the job without bulk_update()'s
+        # per row CASE expressions
+        values = {
+            field: getattr(objs[0], field)
+            for field in update_fields
+        }
+        uniform = all(getattr(obj, field) == value for obj in objs[1:] for field, value in values.items())
+
+        # use a savepoint (unlike bulk_update() on its own) so that a failure
+        # leaves any enclosing transaction usable, e.g. for retrying timer by timer
+        with transaction.atomic():
+            if uniform:
+                values['modified'] = modified
+                chunk_size = const.NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE
+                for offset in range(0, len(objs), chunk_size):
+                    SQLNotificationCallbackTimer.objects.filter(
+                        pk__in=[obj.pk for obj in objs[offset:offset + chunk_size]]
+                    ).update(**values)
+            else:
+                SQLNotificationCallbackTimer.objects.bulk_update(
+                    objs,
+                    list(update_fields) + ['modified'],
+                    batch_size=const.NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE
+                )
+
     def get_notification_timer(self, name):
         """
         Will return a single NotificationCallbackTimer
@@ -398,21 +428,37 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
 
     def get_all_active_timers(self, until_time=None, include_executed=False):
         """
-        Will return all active timers that are expired as a list
+        Will return a generator over all active timers that are expired
 
         If until_time is not passed in, then we will use our
         current system time
+
+        NOTE: Timers are fetched NOTIFICATION_TIMER_FETCH_CHUNK_SIZE at a time,
+              paging on the primary key, so that we never hold a large backlog
+              in memory. Callers can safely update the timers they've been handed
+              before asking for the next one
         """
 
         objs = SQLNotificationCallbackTimer.objects.filter(
             callback_at__lte=until_time if until_time else datetime.now(pytz.UTC),
             is_active=True
-        )
+        ).order_by('name')
 
         if not include_executed:
             objs = objs.filter(executed_at__isnull=True)
 
-        return [obj.to_data_object() for obj in objs]
+        last_name = None
+        while True:
+            page = objs.filter(name__gt=last_name) if last_name is not None else objs
+            page = list(page[:const.NOTIFICATION_TIMER_FETCH_CHUNK_SIZE])
+
+            for obj in page:
+                yield obj.to_data_object()
+
+            if len(page) < const.NOTIFICATION_TIMER_FETCH_CHUNK_SIZE:
+                return
+
+            last_name = page[-1].name
 
     def get_notification_preference(self, name):
         """
@@ -461,7 +507,10 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         else raises exception ItemNotFoundError
         """
         try:
-            obj = SQLUserNotificationPreferences.objects.get(user_id=user_id, preference__name=name)
+            obj = SQLUserNotificationPreferences.objects.select_related('preference').get(
+                user_id=user_id,
+                preference__name=name
+            )
         except ObjectDoesNotExist:
             raise ItemNotFoundError()
 
@@ -493,7 +542,7 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         """
         This returns list of all UserNotificationPreference.
         """
-        query = SQLUserNotificationPreferences.objects.filter(user_id=user_id)
+        query = SQLUserNotificationPreferences.objects.select_related('preference').filter(user_id=user_id)
 
         result_set = [item.to_data_object() for item in query]
 
@@ -514,7 +563,10 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         if size is None:
             size = const.USER_PREFERENCE_MAX_LIST_SIZE
 
-        query = SQLUserNotificationPreferences.objects.filter(preference__name=name, value=value)
+        query = SQLUserNotificationPreferences.objects.select_related('preference').filter(
+            preference__name=name,
+            value=value
+        )
 
         query = query[offset:offset + size]
 
@@ -536,12 +588,19 @@ class SQLNotificationStoreProvider(BaseNotificationStoreProvider):
         where as purge_unread_messages_older_than will compare against the "created" column.
         """
 
+        query = SQLUserNotification.objects.all()
+        if not const.NOTIFICATION_ARCHIVE_ENABLED:
+            # the pre_delete archive receiver forces Django to fetch every
+            # row being deleted; only pull the full rows (including the
+            # user_context TEXT column) when they are actually archived
+            query = query.only('id')
+
         if purge_read_messages_older_than is not None:
-            SQLUserNotification.objects.filter(
+            query.filter(
                 read_at__lte=purge_read_messages_older_than).delete()
 
         if purge_unread_messages_older_than is not None:
-            SQLUserNotification.objects.filter(
+            query.filter(
                 created__lte=purge_unread_messages_older_than,
                 read_at__isnull=True
             ).delete()
@@ -4,9 +4,16 @@ Specific tests for the models.py file
 
 
 
+import sys
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import serializers
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction, IntegrityError
 from django.test import TestCase
 
-from edx_notifications.data import NotificationType, NotificationMessage
+from edx_notifications.data import NotificationType, NotificationMessage, UserNotification
 from edx_notifications.stores.sql.models import (
     SQLNotificationType,
     SQLUserNotification,
@@ -15,6 +22,14 @@ from edx_notifications.stores.sql.models import (
 )
 
 
+def run_on_commit(func, using=None):  # pylint: disable=unused-argument
+    """
+    TestCase never commits, so run any on_commit() hooks right away
+    like they would be after a save in autocommit mode
+    """
+    func()
+
+
 class SQLModelsTests(TestCase):
     """
     Test cases for the models.py classes
@@ -51,6 +66,211 @@ class SQLModelsTests(TestCase):
         msg = orm_obj.to_data_object()
         self.assertIsNotNone(msg)
 
+    def test_dict_text_field(self):
+        """
+        Make sure dict columns are stored as JSON strings and come back
+        out of the ORM as dicts
+        """
+
+        msg_type = SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer')
+        msg_type.save()
+
+        orm_obj = SQLNotificationMessage(
+            msg_type=msg_type,
+            payload={'foo': 'bar', 'one': 1},
+        )
+        orm_obj.save()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT payload, resolve_links FROM edx_notifications_notificationmessage WHERE id = %s',
+                [orm_obj.id]
+            )
+            raw_payload, raw_resolve_links = cursor.fetchone()
+
+        self.assertIsInstance(raw_payload, str)
+        self.assertIsNone(raw_resolve_links)
+
+        fetched = SQLNotificationMessage.objects.get(id=orm_obj.id)
+        self.assertEqual(fetched.payload, {'foo': 'bar', 'one': 1})
+        self.assertIsNone(fetched.resolve_links)
+        self.assertEqual(fetched.to_data_object().payload, {'foo': 'bar', 'one': 1})
+
+        # make sure the field round trips through Django's serialization (e.g. fixtures)
+        field = SQLNotificationMessage._meta.get_field('payload')  # pylint: disable=protected-access
+        self.assertEqual(field.to_python(field.value_to_string(fetched)), {'foo': 'bar', 'one': 1})
+
+        serialized = serializers.serialize('json', [fetched])
+        deserialized = next(serializers.deserialize('json', serialized)).object
+        self.assertEqual(deserialized.payload, {'foo': 'bar', 'one': 1})
+
+    def test_dict_text_field_decoded_once(self):
+        """
+        Make sure the JSON columns are decoded once when the row is loaded, and not
+        every time the same ORM instance is turned into a data object
+        """
+
+        msg_type = SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer')
+        msg_type.save()
+
+        SQLNotificationMessage(msg_type=msg_type, payload={'foo': 'bar'}).save()
+
+        orm_obj = SQLNotificationMessage.objects.select_related('msg_type').get()
+
+        with mock.patch('edx_notifications.base_data.DictField.from_json') as mock_from_json:
+            first = orm_obj.to_data_object()
+            second = orm_obj.to_data_object()
+
+        self.assertFalse(mock_from_json.called)
+        self.assertEqual(first.payload, {'foo': 'bar'})
+        self.assertIs(first.payload, second.payload)
+
+    @mock.patch('django.db.transaction.on_commit', run_on_commit)
+    def test_notification_type_data_object_cache(self):
+        """
+        Make sure NotificationType data objects built from database rows are
+        shared, and that saving the type drops the cached copy
+        """
+
+        SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer').save()
+
+        first = SQLNotificationType.objects.get(name='foo.bar.baz').to_data_object()
+        with self.assertNumQueries(0):
+            second = SQLNotificationType.get_data_object('foo.bar.baz')
+        self.assertEqual(first, second)
+
+        # everyone gets their own copy
+        self.assertIsNot(first, second)
+        first.renderer = 'changed.renderer'
+        self.assertEqual(SQLNotificationType.get_data_object('foo.bar.baz').renderer, 'foo.renderer')
+
+        # unsaved instances are never served from the cache
+        unsaved = SQLNotificationType(name='foo.bar.baz', renderer='other.renderer')
+        self.assertEqual(unsaved.to_data_object().renderer, 'other.renderer')
+
+        unsaved.save()
+
+        updated = SQLNotificationType.objects.get(name='foo.bar.baz').to_data_object()
+        self.assertIsNot(updated, first)
+        self.assertEqual(updated.renderer, 'other.renderer')
+
+    @mock.patch('django.db.transaction.on_commit', run_on_commit)
+    def test_message_type_from_cache(self):
+        """
+        Make sure that a SQLNotificationMessage can resolve its NotificationType
+        from the in-process cache rather than a JOIN or another query
+        """
+
+        msg_type = SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer')
+        msg_type.save()
+
+        SQLNotificationMessage(msg_type=msg_type, payload={'foo': 'bar'}).save()
+
+        orm_obj = SQLNotificationMessage.objects.get()
+
+        with self.assertNumQueries(0):
+            msg = orm_obj.to_data_object()
+
+        self.assertEqual(msg.msg_type.name, 'foo.bar.baz')
+        self.assertEqual(msg.msg_type.renderer, 'foo.renderer')
+
+        # on a cache miss all of the types get loaded in one query
+        SQLNotificationType.invalidate_cached_data_object('foo.bar.baz')
+        orm_obj = SQLNotificationMessage.objects.get()
+
+        with self.assertNumQueries(1):
+            msg = orm_obj.to_data_object()
+
+        self.assertEqual(msg.msg_type.renderer, 'foo.renderer')
+
+    def test_notification_type_cache_threads(self):
+        """
+        Make sure the NotificationType cache can be used from several threads
+        at once, e.g. by timer callbacks running on a pool of workers
+        """
+
+        SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer').save()
+        SQLNotificationType(name='foo.bar.qux', renderer='foo.renderer').save()
+        objs = list(SQLNotificationType.objects.all())
+
+        # make the entries churn, and the threads switch as often as possible
+        SQLNotificationType.set_data_object_cache_size(1)
+        self.addCleanup(SQLNotificationType.set_data_object_cache_size, 1024)
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+        def _hydrate():
+            """
+            Hydrate and invalidate the types over and over again
+            """
+            for index in range(500):
+                obj = objs[index % 2]
+                self.assertEqual(obj.to_data_object().name, obj.name)
+                if index % 3 == 0:
+                    SQLNotificationType.invalidate_cached_data_object(obj.name)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_hydrate) for __ in range(4)]
+
+        for future in futures:
+            future.result()
+
+    def test_notification_type_cache_rollback(self):
+        """
+        Make sure that a NotificationType saved in a transaction which
+        gets rolled back does not linger in the cache
+        """
+
+        try:
+            with transaction.atomic():
+                SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer').save()
+                raise IntegrityError()
+        except IntegrityError:
+            pass
+
+        with self.assertRaises(ObjectDoesNotExist):
+            SQLNotificationType.get_data_object('foo.bar.baz')
+
+    def test_notification_type_cached_on_commit(self):
+        """
+        Make sure that NotificationTypes read inside of a transaction are
+        only cached once it has been committed
+        """
+
+        SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer').save()
+
+        # TestCase never commits, so this should not get cached
+        SQLNotificationType.get_data_object('foo.bar.baz')
+
+        with self.assertNumQueries(1):
+            SQLNotificationType.get_data_object('foo.bar.baz')
+
+    def test_bulk_from_data_objects_keys(self):
+        """
+        Make sure that a saved message and an unsaved one are never mixed
+        up, even if the primary key matches the unsaved object's id()
+        """
+
+        msg_type = SQLNotificationType(name='foo.bar.baz', renderer='foo.renderer')
+        msg_type.save()
+
+        saved_msg = SQLNotificationMessage(msg_type=msg_type, payload={'foo': 'bar'})
+        saved_msg.save()
+        saved_msg = saved_msg.to_data_object()
+
+        unsaved_msg = NotificationMessage(msg_type=msg_type.to_data_object(), payload={'foo': 'baz'})
+
+        with mock.patch('edx_notifications.stores.sql.models.id', create=True, return_value=saved_msg.id):
+            objs = SQLUserNotification.bulk_from_data_objects([
+                UserNotification(user_id=1, msg=saved_msg),
+                UserNotification(user_id=1, msg=unsaved_msg),
+                UserNotification(user_id=2, msg=saved_msg),
+            ])
+
+        self.assertIs(objs[0].msg, objs[2].msg)
+        self.assertIsNot(objs[0].msg, objs[1].msg)
+        self.assertEqual(objs[1].msg.payload, {'foo': 'baz'})
+
     def test_user_notification_model_fields(self):  # pylint: disable=C0103
         """
         Test to check that the SQLUserNotification Model has all the fields (names) of
@@ -9,7 +9,10 @@ from datetime import datetime, timedelta
 from unittest import mock
 import pytz
 from freezegun import freeze_time
+from django.db import connection, DatabaseError
+from django.db.models.query import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from edx_notifications import const
 from edx_notifications.data import (
@@ -21,8 +24,13 @@ from edx_notifications.data import (
     UserNotificationPreferences
 )
 from edx_notifications.exceptions import ItemNotFoundError, BulkOperationTooLarge
-from edx_notifications.stores.sql.models import SQLUserNotification, SQLUserNotificationArchive
+from edx_notifications.stores.sql.models import (
+    SQLNotificationType,
+    SQLUserNotification,
+    SQLUserNotificationArchive
+)
 from edx_notifications.stores.sql.store_provider import SQLNotificationStoreProvider
+from edx_notifications.stores.sql.tests.test_models import run_on_commit
 
 
 class TestSQLStoreProvider(TestCase):
@@ -38,6 +46,10 @@ class TestSQLStoreProvider(TestCase):
         self.provider = SQLNotificationStoreProvider()
         self.test_user_id = 1
 
+        patcher = mock.patch('django.db.transaction.on_commit', run_on_commit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def _save_notification_type(self):
         """
         Helper to set up a notification_type
@@ -65,7 +77,8 @@ class TestSQLStoreProvider(TestCase):
 
         self.assertIsNotNone(notification_type)
 
-        with self.assertNumQueries(1):
+        # saving the type caches it, so there should be no round-trips to SQL
+        with self.assertNumQueries(0):
             result = self.provider.get_notification_type(notification_type.name)
 
         self.assertIsNotNone(result)
@@ -77,21 +90,11 @@ class TestSQLStoreProvider(TestCase):
         self.assertEqual(len(result_set), 1)
         self.assertEqual(result_set[0], notification_type)
 
-        # re-getting notification type should pull from cache
-        # so there should be no round-trips to SQL
-        with self.assertNumQueries(0):
-            result = self.provider.get_notification_type(notification_type.name)
-
-        self.assertIsNotNone(result)
-        self.assertEqual(result, notification_type)
-
-        # re-save and make sure the cache entry got invalidated
+        # re-save and make sure the cache entry got refreshed
         with self.assertNumQueries(2):
             notification_type = self._save_notification_type()
 
-        # since we invalidated the cached entry on the last save
-        # when we re-query we'll hit another SQL round trip
-        with self.assertNumQueries(1):
+        with self.assertNumQueries(0):
             result = self.provider.get_notification_type(notification_type.name)
 
         self.assertIsNotNone(result)
@@ -307,6 +310,39 @@ class TestSQLStoreProvider(TestCase):
 
         self.assertEqual(msg, saved_msg)
 
+    def test_saved_notification_payload(self):
+        """
+        Make sure that saving a notification hands back the same data that
+        loading it would, and not the caller's own dicts
+        """
+
+        now = datetime.now(pytz.UTC)
+        payload = {1: 'one', 'when': now, 'nested': {'when': now}}
+
+        msg = self.provider.save_notification_message(NotificationMessage(
+            namespace='namespace1',
+            msg_type=self._save_notification_type(),
+            payload=payload
+        ))
+
+        self.assertIsNot(msg.payload, payload)
+        self.assertEqual(msg.payload, self.provider.get_notification_message_by_id(msg.id).payload)
+        self.assertEqual(msg.payload['1'], 'one')
+        self.assertEqual(msg.payload['when'], now)
+        self.assertEqual(msg.payload['nested'], {'when': now.isoformat()})
+
+        # changing what we got back does not change the caller's dict
+        msg.payload['foo'] = 'bar'
+        self.assertNotIn('foo', payload)
+
+        # the same goes for the message of a saved user notification
+        user_msg = self.provider.save_user_notification(UserNotification(
+            user_id=self.test_user_id,
+            msg=msg
+        ))
+        self.assertIsNot(user_msg.msg.payload, msg.payload)
+        self.assertEqual(user_msg.msg.payload, msg.payload)
+
     def test_load_notification(self):
         """
         Save and fetch a new notification
@@ -314,9 +350,13 @@ class TestSQLStoreProvider(TestCase):
 
         msg = self._save_new_notification()
 
-        with self.assertNumQueries(1):
+        with CaptureQueriesContext(connection) as queries:
             fetched_msg = self.provider.get_notification_message_by_id(msg.id)
 
+        # the NotificationType does not need to be JOINed in
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
         self.assertIsNotNone(fetched_msg)
         self.assertEqual(msg.id, fetched_msg.id)
         self.assertEqual(msg.payload, fetched_msg.payload)
@@ -324,9 +364,9 @@ class TestSQLStoreProvider(TestCase):
         self.assertEqual(msg.resolve_links, fetched_msg.resolve_links)
         self.assertEqual(msg.object_id, fetched_msg.object_id)
 
-        # by not selecting_related (default True), this will cause another round
-        # trip to the database
-        with self.assertNumQueries(2):
+        # the NotificationType is always served from the in-process cache,
+        # so not selecting_related makes no difference
+        with self.assertNumQueries(1):
             fetched_msg = self.provider.get_notification_message_by_id(
                 msg.id,
                 options={
@@ -358,6 +398,37 @@ class TestSQLStoreProvider(TestCase):
             msg.id = 9999999
             self.provider.save_notification_message(msg)
 
+    def test_notification_type_cache_shared(self):
+        """
+        Make sure the provider and the ORM models share one NotificationType
+        cache, which is sized by MAX_MSG_TYPE_CACHE_SIZE
+        """
+
+        provider = SQLNotificationStoreProvider(MAX_MSG_TYPE_CACHE_SIZE=10)
+        self.addCleanup(SQLNotificationType.set_data_object_cache_size, 1024)
+        self.assertEqual(SQLNotificationType._data_object_cache.size(), 10)  # pylint: disable=protected-access
+
+        notification_type = self._save_notification_type()
+
+        # a change made directly through the ORM is seen by the provider
+        obj = SQLNotificationType.objects.get(name=notification_type.name)
+        obj.renderer = 'foo.renderer'
+        obj.save()
+
+        with self.assertNumQueries(0):
+            result = provider.get_notification_type(notification_type.name)
+
+        self.assertEqual(result.renderer, 'foo.renderer')
+        self.assertEqual(result, SQLNotificationType.get_data_object(notification_type.name))
+
+        # neither the caller's dicts nor what we hand out are shared with the cache
+        notification_type.renderer_context['param1'] = 'changed'
+        result.renderer_context['param1'] = 'changed'
+        self.assertEqual(
+            provider.get_notification_type(notification_type.name).renderer_context,
+            {'param1': 'value1'}
+        )
+
     def test_cant_find_notification_type(self):
         """
         Negative test for loading notification type
@@ -876,6 +947,13 @@ class TestSQLStoreProvider(TestCase):
             self.assertEqual(len(notifications), 1)
             self.assertEqual(notifications[0].msg, msg)
 
+        # re-sending to the same users should not create any duplicates
+        with self.assertNumQueries(1):
+            self.provider.bulk_create_user_notification(user_msgs[:10])
+
+        for user_id in range(10):
+            self.assertEqual(self.provider.get_num_notifications_for_user(user_id), 1)
+
         # now test if we send in a size too large that an exception is raised
         user_msgs.append(
             UserNotification(user_id=user_id, msg=msg)
@@ -922,12 +1000,38 @@ class TestSQLStoreProvider(TestCase):
         timer_executed_read = self.provider.get_notification_timer(timer_executed_saved.name)
         self.assertEqual(timer_executed_saved, timer_executed_read)
 
-        timers_not_executed = self.provider.get_all_active_timers()
+        timers_not_executed = list(self.provider.get_all_active_timers())
         self.assertEqual(len(timers_not_executed), 1)
 
-        timers_incl_executed = self.provider.get_all_active_timers(include_executed=True)
+        timers_incl_executed = list(self.provider.get_all_active_timers(include_executed=True))
         self.assertEqual(len(timers_incl_executed), 2)
 
+    @mock.patch('edx_notifications.const.NOTIFICATION_TIMER_FETCH_CHUNK_SIZE', 2)
+    def test_get_all_active_timers_paging(self):
+        """
+        Make sure that active timers are fetched in chunks, and that
+        timers can be updated while we iterate over them
+        """
+
+        for index in range(5):
+            self.provider.save_notification_timer(
+                NotificationCallbackTimer(
+                    name='timer{index}'.format(index=index),
+                    callback_at=datetime.now(pytz.UTC) - timedelta(0, 1),
+                    class_name='foo.bar',
+                    is_active=True,
+                )
+            )
+
+        names = []
+        for timer in self.provider.get_all_active_timers():
+            timer.executed_at = datetime.now(pytz.UTC)
+            self.provider.save_notification_timer(timer)
+            names.append(timer.name)
+
+        self.assertEqual(names, ['timer{index}'.format(index=index) for index in range(5)])
+        self.assertEqual(list(self.provider.get_all_active_timers()), [])
+
     def test_save_update_time(self):
         """
         Verify the update case of saving a timer
@@ -953,6 +1057,87 @@ class TestSQLStoreProvider(TestCase):
         timer_read = self.provider.get_notification_timer(timer_saved_twice.id)
         self.assertEqual(timer_saved_twice, timer_read)
 
+    def test_bulk_update_timers(self):
+        """
+        Verify that bulk updating timers writes one statement, and
+        skips the per row CASE expressions when all values are the same
+        """
+
+        timers = [
+            self.provider.save_notification_timer(NotificationCallbackTimer(
+                name='timer{index}'.format(index=index),
+                callback_at=datetime.now(pytz.UTC) - timedelta(0, 1),
+                class_name='foo.bar',
+                is_active=True,
+                periodicity_min=120,
+            ))
+            for index in range(3)
+        ]
+
+        executed_at = datetime.now(pytz.UTC)
+        for timer in timers:
+            timer.executed_at = executed_at
+
+        with CaptureQueriesContext(connection) as queries:
+            self.provider.bulk_update_notification_timers(timers, ['executed_at'])
+
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('CASE', updates[0])
+
+        for index, timer in enumerate(timers):
+            timer.err_msg = 'error{index}'.format(index=index)
+
+        self.provider.bulk_update_notification_timers(timers, ['err_msg'])
+
+        for index, timer in enumerate(timers):
+            timer_read = self.provider.get_notification_timer(timer.name)
+            self.assertEqual(timer_read.executed_at, executed_at)
+            self.assertEqual(timer_read.err_msg, 'error{index}'.format(index=index))
+            self.assertGreater(timer_read.modified, timer_read.created)
+
+    @mock.patch('edx_notifications.const.NOTIFICATION_TIMER_BULK_UPDATE_CHUNK_SIZE', 2)
+    def test_bulk_update_timers_atomic(self):
+        """
+        Verify that a bulk update of timers spanning several statements
+        is all or nothing
+        """
+
+        timers = [
+            self.provider.save_notification_timer(NotificationCallbackTimer(
+                name='timer{index}'.format(index=index),
+                callback_at=datetime.now(pytz.UTC) - timedelta(0, 1),
+                class_name='foo.bar',
+                is_active=True,
+                periodicity_min=120,
+            ))
+            for index in range(3)
+        ]
+
+        executed_at = datetime.now(pytz.UTC)
+        for timer in timers:
+            timer.executed_at = executed_at
+
+        update = QuerySet.update
+
+        def _update(query, **kwargs):
+            """
+            Fail the second UPDATE statement
+            """
+            _update.num_calls += 1
+            if _update.num_calls == 2:
+                raise DatabaseError('This did not work!')
+            return update(query, **kwargs)
+
+        _update.num_calls = 0
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=_update):
+            with self.assertRaises(DatabaseError):
+                self.provider.bulk_update_notification_timers(timers, ['executed_at'])
+
+        for timer in timers:
+            self.assertIsNone(self.provider.get_notification_timer(timer.name).executed_at)
+
     def test_update_is_active_timer(self):
         """
         Verify that we can change the is_active flag on
@@ -1072,7 +1257,7 @@ class TestSQLStoreProvider(TestCase):
             user_id=1,
             value='User Preference 1'
         )
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             read_user_notification_preference = self.provider.get_user_preference(
                 user_notification_preference.user_id,
                 user_notification_preference.preference.name
@@ -1094,7 +1279,7 @@ class TestSQLStoreProvider(TestCase):
         with self.assertNumQueries(2):
             updated_user_preferences = self.provider.set_user_preference(user_notification_preferences)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             read_updated_user_notification_preferences = self.provider.get_user_preference(
                 updated_user_preferences.user_id,
                 updated_user_preferences.preference.name
@@ -1122,7 +1307,7 @@ class TestSQLStoreProvider(TestCase):
                 user_id=user_id,
                 value='User Preferences'
             )
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(1):
             result = self.provider.get_all_user_preferences_for_user(user_id)
         self.assertEqual(len(result), 5)
 
@@ -1155,7 +1340,7 @@ class TestSQLStoreProvider(TestCase):
                 )
 
         # test limit, we should only get the first one
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             user_preferences = self.provider.get_all_user_preferences_with_name(
                 name='test_preference',
                 value='User-Preferences',
@@ -1166,7 +1351,7 @@ class TestSQLStoreProvider(TestCase):
             self.assertEqual(user_preferences[0], user_preference1)
 
         # test limit with offset, we should only get the 2nd one
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             user_preferences = self.provider.get_all_user_preferences_with_name(
                 name='test_preference',
                 value='User-Preferences',
@@ -1179,7 +1364,7 @@ class TestSQLStoreProvider(TestCase):
             self.assertEqual(user_preferences[0], user_preference2)
 
         # test that limit should be able to exceed bounds
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             user_preferences = self.provider.get_all_user_preferences_with_name(
                 name='test_preference',
                 value='User-Preferences',
@@ -1259,6 +1444,38 @@ class TestSQLStoreProvider(TestCase):
             1
         )
 
+    def test_purge_skips_unused_columns(self):
+        """
+        Make sure that purging without archiving does not load
+        the user_context column of the rows being deleted
+        """
+        msg_type = self._save_notification_type()
+        msg = self.provider.save_notification_message(NotificationMessage(
+            namespace='namespace1',
+            msg_type=msg_type,
+            payload={
+                'foo': 'bar'
+            }
+        ))
+        self.provider.save_user_notification(UserNotification(
+            user_id=self.test_user_id,
+            msg=msg,
+            user_context={'foo': 'bar'}
+        ))
+
+        with mock.patch('edx_notifications.const.NOTIFICATION_ARCHIVE_ENABLED', False):
+            with CaptureQueriesContext(connection) as queries:
+                self.provider.purge_expired_notifications(
+                    purge_unread_messages_older_than=datetime.now(pytz.UTC) + timedelta(days=1)
+                )
+
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNotIn('user_context', sql)
+
+        self.assertEqual(self.provider.get_num_notifications_for_user(self.test_user_id), 0)
+
     def test_purge_expired_read_notifications(self):
         """
         Test to check for the older read messages.
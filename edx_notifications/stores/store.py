@@ -199,6 +199,18 @@ class BaseNotificationStoreProvider(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def bulk_update_notification_timers(self, timers, update_fields):
+        """
+        This is an optimization for updating a batch of *existing*
+        NotificationCallbackTimers with as few round trips to the
+        database as possible. Only the columns named in update_fields
+        will be written
+
+        NOTE: This method cannot create new NotificationCallbackTimers
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def get_notification_timer(self, name):
         """
@@ -209,7 +221,8 @@ class BaseNotificationStoreProvider(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def get_all_active_timers(self, until_time=None, include_executed=False):
         """
-        Will return all active timers that are expired.
+        Will return all active timers that are expired. This can be a
+        generator, so callers should only assume an iterable
 
         If until_time is not passed in, then we will use our
         current system time
@@ -154,6 +154,12 @@ class BadImplementationStoreProvider(BaseNotificationStoreProvider):
         """
         super().save_notification_timer(None)
 
+    def bulk_update_notification_timers(self, timers, update_fields):
+        """
+        Will update a batch of existing NotificationCallbackTimers
+        """
+        super().bulk_update_notification_timers(None, None)
+
     def get_notification_timer(self, name):
         """
         Will return a single NotificationCallbackTimer
@@ -266,6 +272,9 @@ class TestBaseNotificationDataProvider(TestCase):
         with self.assertRaises(NotImplementedError):
             bad_provider.save_notification_timer(None)
 
+        with self.assertRaises(NotImplementedError):
+            bad_provider.bulk_update_notification_timers(None, None)
+
         with self.assertRaises(NotImplementedError):
             bad_provider.get_notification_timer(None)
 
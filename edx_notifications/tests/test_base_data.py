@@ -4,13 +4,48 @@ Unit tests to exercise code implemented in data.py
 
 
 
+import enum
+import math
+import uuid
+import dataclasses
+from datetime import date, datetime
+from unittest import mock
+
 import six
+import pytz
 from django.test import TestCase
 
+from edx_notifications import base_data
 from edx_notifications.data import NotificationType, NotificationMessage
 from edx_notifications.base_data import DictField, EnumField, IntegerField, BaseDataObject, RelatedObjectField
 
 
+class Level(enum.IntEnum):
+    """
+    Sample IntEnum, which the json module serializes as an int
+    """
+
+    HIGH = 2
+
+
+class Color(enum.Enum):
+    """
+    Sample Enum, which the json module can't serialize
+    """
+
+    RED = 'red'
+
+
+@dataclasses.dataclass
+class Point:
+    """
+    Sample dataclass, which the json module can't serialize
+    """
+
+    x: int
+    y: int
+
+
 class DataObject(BaseDataObject):
     """
     Sample very simple test data object
@@ -284,3 +319,85 @@ class BaseDataObjectTests(TestCase):
         )
 
         self.assertNotEqual(obj1, obj2)
+
+    def test_dict_field_json(self):
+        """
+        Make sure DictField serializes to and from JSON, including
+        datetimes and non-string keys
+        """
+
+        now = datetime.now(pytz.UTC)
+
+        self.assertIsNone(DictField.to_json({}))
+        self.assertIsNone(DictField.from_json(None))
+
+        serialized = DictField.to_json({'foo': 'bar', 'when': now, 1: 'one'})
+        self.assertEqual(
+            DictField.from_json(serialized),
+            {'foo': 'bar', 'when': now, '1': 'one'}
+        )
+
+        # values written by the stdlib json module can still be read back
+        self.assertEqual(DictField.from_json('{"foo": NaN}').keys(), {'foo'})
+
+        with self.assertRaises(TypeError):
+            DictField.to_json({'foo': object()})
+
+    def test_dict_field_json_without_orjson(self):
+        """
+        Make sure DictField serializes the same values the same way
+        whether or not orjson is installed
+        """
+
+        data = {
+            'big': 2 ** 70,
+            'nan': float('nan'),
+            'inf': float('inf'),
+            'none': None,
+            'when': datetime(2020, 1, 1, 12, 30, tzinfo=pytz.UTC),
+            'nested': [{'nan': float('nan')}],
+            'level': Level.HIGH,
+            2: 'two',
+        }
+
+        with_orjson = DictField.from_json(DictField.to_json(data))
+        with mock.patch('edx_notifications.base_data.orjson', None):
+            without_orjson = DictField.from_json(DictField.to_json(data))
+
+        for result in [with_orjson, without_orjson]:
+            self.assertEqual(result['big'], 2 ** 70)
+            self.assertTrue(math.isnan(result['nan']))
+            self.assertEqual(result['inf'], float('inf'))
+            self.assertIsNone(result['none'])
+            self.assertEqual(result['when'], data['when'])
+            self.assertTrue(math.isnan(result['nested'][0]['nan']))
+            self.assertEqual(result['level'], 2)
+            self.assertEqual(result['2'], 'two')
+
+        # none of these are serializable either way
+        for value in [date(2020, 1, 1), uuid.uuid4(), Color.RED, Point(1, 2)]:
+            for _orjson in [base_data.orjson, None]:
+                with mock.patch('edx_notifications.base_data.orjson', _orjson):
+                    with self.assertRaises(TypeError):
+                        DictField.to_json({'foo': value})
+
+    def test_fields_introspected_once(self):
+        """
+        Make sure the schema of a DataObject class is only introspected
+        once, rather than on every get_fields()/comparison/attribute write
+        """
+
+        obj = DataObjectWithTypedFields(test_int_field=1)
+        obj.get_fields()
+
+        with mock.patch('edx_notifications.base_data.inspect.getmembers') as getmembers:
+            obj.test_int_field = 2
+            fields = obj.get_fields()
+            self.assertEqual(obj, obj)
+
+        self.assertFalse(getmembers.called)
+        self.assertEqual(fields['test_int_field'], 2)
+        self.assertEqual(
+            sorted(fields.keys()),
+            ['id', 'test_class_field', 'test_dict_field', 'test_enum_field', 'test_int_field']
+        )
@@ -4,15 +4,19 @@ Tests for the timer.py
 
 
 
+import threading
 from datetime import datetime, timedelta
+from unittest import mock
 
 import pytz
 from freezegun import freeze_time
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from edx_notifications import startup
 from edx_notifications.data import NotificationType, NotificationMessage, NotificationCallbackTimer
-from edx_notifications.timer import poll_and_execute_timers
+from edx_notifications.timer import poll_and_execute_timers, _resolve_callback_class, TIMER_STATE_FIELDS
 from edx_notifications.scopes import register_user_scope_resolver
 from edx_notifications.callbacks import NotificationCallbackTimerHandler
 from edx_notifications.exceptions import ItemNotFoundError
@@ -59,6 +63,33 @@ class ExceptionNotificationCallbackTimerHandler(NotificationCallbackTimerHandler
         raise Exception('This did not work!')
 
 
+class UnserializableNotificationCallbackTimerHandler(NotificationCallbackTimerHandler):
+    """
+    Returns results which can't be stored
+    """
+
+    def notification_timer_callback(self, timer):
+        """
+        Return something that isn't JSON serializable
+        """
+        return {'obj': object()}
+
+
+class BarrierNotificationCallbackTimerHandler(NotificationCallbackTimerHandler):
+    """
+    Waits for another callback to be running at the same time
+    """
+
+    barrier = None
+
+    def notification_timer_callback(self, timer):
+        """
+        Wait on the barrier, this raises BrokenBarrierError on timeout
+        """
+        self.barrier.wait(timeout=5)
+        return {}
+
+
 class TimerTests(TestCase):
     """
     Test cases for timer.py
@@ -110,6 +141,112 @@ class TimerTests(TestCase):
         self.assertIsNone(timer1.err_msg)
         self.assertNotEqual(timer.callback_at, timer1.callback_at)  # verify the callback time is incremented
 
+    def _save_timers(self, num_timers, class_name, start=0):
+        """
+        Helper to register a number of recurring timers, named foo<index>,
+        which are all due to be executed
+        """
+
+        for index in range(start, start + num_timers):
+            self.store.save_notification_timer(
+                NotificationCallbackTimer(
+                    name='foo{index}'.format(index=index),
+                    class_name=class_name,
+                    callback_at=datetime.now(pytz.UTC) - timedelta(days=index + 1),
+                    context={'index': index},
+                    is_active=True,
+                    periodicity_min=1
+                )
+            )
+
+    def test_batched_timer_updates(self):
+        """
+        Make sure the database round trips to record timer executions
+        do not grow with the number of timers
+        """
+
+        def _poll_timers(num_timers):
+            """
+            Helper to register and poll a number of recurring timers
+            """
+            self._save_timers(num_timers, 'edx_notifications.tests.test_timer.NullNotificationCallbackTimerHandler')
+
+            with CaptureQueriesContext(connection) as queries:
+                poll_and_execute_timers()
+
+            return len(queries)
+
+        num_queries_one = _poll_timers(1)
+        num_queries_many = _poll_timers(10)
+
+        self.assertEqual(num_queries_one, num_queries_many)
+
+        for index in range(10):
+            timer = self.store.get_notification_timer('foo{index}'.format(index=index))
+            self.assertIsNone(timer.executed_at)
+            self.assertIsNone(timer.err_msg)
+            self.assertGreater(timer.callback_at, datetime.now(pytz.UTC))
+
+    def test_callback_class_resolved_once(self):
+        """
+        Make sure timers which share a callback class only cause
+        the class_name to be parsed and imported once
+        """
+
+        self._save_timers(3, 'edx_notifications.tests.test_timer.NullNotificationCallbackTimerHandler')
+
+        _resolve_callback_class.cache_clear()
+
+        poll_and_execute_timers()
+
+        cache_info = _resolve_callback_class.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 2)
+
+    @mock.patch('edx_notifications.const.NOTIFICATION_TIMER_WORKERS', 4)
+    def test_concurrent_timers(self):
+        """
+        Make sure timers can be run on a pool of worker threads
+        """
+
+        class_names = [
+            'edx_notifications.tests.test_timer.NullNotificationCallbackTimerHandler',
+            'edx_notifications.tests.test_timer.ExceptionNotificationCallbackTimerHandler',
+        ]
+
+        for index in range(6):
+            self._save_timers(1, class_names[index % 2], start=index)
+
+        poll_and_execute_timers()
+
+        for index in range(6):
+            timer = self.store.get_notification_timer('foo{index}'.format(index=index))
+            if index % 2:
+                # the exception should have been caught and recorded
+                self.assertFalse(timer.is_active)
+                self.assertIsNotNone(timer.err_msg)
+            else:
+                self.assertTrue(timer.is_active)
+                self.assertIsNone(timer.executed_at)
+                self.assertIsNone(timer.err_msg)
+
+    @mock.patch('edx_notifications.const.NOTIFICATION_TIMER_WORKERS', 4)
+    @mock.patch.object(BarrierNotificationCallbackTimerHandler, 'barrier', threading.Barrier(2))
+    def test_callbacks_overlap(self):
+        """
+        Make sure that the worker threads actually run callbacks at the same time
+        """
+
+        self._save_timers(2, 'edx_notifications.tests.test_timer.BarrierNotificationCallbackTimerHandler')
+
+        poll_and_execute_timers()
+
+        # if the callbacks had run one after the other, the barrier would have timed out
+        for index in range(2):
+            timer = self.store.get_notification_timer('foo{index}'.format(index=index))
+            self.assertTrue(timer.is_active)
+            self.assertIsNone(timer.err_msg)
+
     def test_bad_handler(self):
         """
         Make sure that a timer with a bad class_name doesn't operate
@@ -132,6 +269,98 @@ class TimerTests(TestCase):
         self.assertIsNotNone(updated_timer.executed_at)
         self.assertIsNotNone(updated_timer.err_msg)
 
+    def test_bad_handler_batch(self):
+        """
+        Make sure that a batch of timers sharing a bad class_name are
+        all disabled with a single UPDATE
+        """
+
+        self._save_timers(5, 'edx_notifications.badmodule.BadHandler')
+
+        with CaptureQueriesContext(connection) as queries:
+            poll_and_execute_timers()
+
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        # one to mark the timers as executed, one to disable them
+        self.assertEqual(len(updates), 2)
+
+        for index in range(5):
+            updated_timer = self.store.get_notification_timer('foo{index}'.format(index=index))
+            self.assertFalse(updated_timer.is_active)
+            self.assertIsNotNone(updated_timer.executed_at)
+            self.assertIsNotNone(updated_timer.err_msg)
+            self.assertEqual(updated_timer.context, {'index': index})
+
+    def _save_mixed_timers(self):
+        """
+        Helper to register a good, a bad and another good recurring timer
+        """
+
+        for index, handler in enumerate(['Null', 'Unserializable', 'Null']):
+            self._save_timers(
+                1,
+                'edx_notifications.tests.test_timer.{handler}NotificationCallbackTimerHandler'.format(handler=handler),
+                start=index
+            )
+
+    def _assert_mixed_timers(self):
+        """
+        Helper to check that only the bad timer got disabled
+        """
+
+        for name in ['foo0', 'foo2']:
+            timer = self.store.get_notification_timer(name)
+            self.assertTrue(timer.is_active)
+            self.assertIsNone(timer.executed_at)
+            self.assertIsNone(timer.err_msg)
+            self.assertGreater(timer.callback_at, datetime.now(pytz.UTC))
+
+        bad_timer = self.store.get_notification_timer('foo1')
+        self.assertFalse(bad_timer.is_active)
+        self.assertIsNotNone(bad_timer.executed_at)
+        self.assertIsNotNone(bad_timer.err_msg)
+
+    def test_unserializable_results(self):
+        """
+        Make sure that a timer whose results can't be stored only
+        fails itself and not the rest of the batch
+        """
+
+        self._save_mixed_timers()
+
+        poll_and_execute_timers()
+
+        self._assert_mixed_timers()
+
+    def test_batch_write_fallback(self):
+        """
+        Make sure that if the batched write fails we fall back to
+        writing the timers one by one
+        """
+
+        self._save_mixed_timers()
+
+        bulk_update = self.store.bulk_update_notification_timers
+
+        def _bulk_update(timers, update_fields):
+            """
+            Fail any multi-timer write of the full timer state
+            """
+            if len(timers) > 1 and 'results' in update_fields:
+                raise Exception('This did not work!')
+            bulk_update(timers, update_fields)
+
+        with mock.patch.object(self.store, 'bulk_update_notification_timers', side_effect=_bulk_update) as mock_update:
+            poll_and_execute_timers()
+
+        # the two good timers got written one by one
+        single_writes = [
+            args for args, __ in mock_update.call_args_list
+            if len(args[0]) == 1 and args[1] == TIMER_STATE_FIELDS
+        ]
+        self.assertEqual(len(single_writes), 2)
+        self._assert_mixed_timers()
+
     def test_error_in_execution(self):
         """
         Make sure recurring timers work
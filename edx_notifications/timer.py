@@ -5,16 +5,19 @@ a callback when the timer expires
 
 
 
-import copy
 import logging
+from functools import lru_cache
 from datetime import datetime, timedelta
 from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
+from django.db import close_old_connections
 from django.dispatch import receiver
 
 from edx_notifications import const
 from edx_notifications.data import NotificationCallbackTimer
+from edx_notifications.base_data import DictField
 from edx_notifications.signals import perform_notification_scan, perform_timer_registrations
 from edx_notifications.exceptions import ItemNotFoundError
 from edx_notifications.stores.store import notification_store
@@ -23,72 +26,169 @@ PURGE_NOTIFICATIONS_TIMER_NAME = 'purge-notifications-timer'
 
 log = logging.getLogger(__name__)
 
+# the timer columns which poll_and_execute_timers() can change after
+# running a callback, so we don't need to rewrite the whole row
+TIMER_STATE_FIELDS = ['callback_at', 'executed_at', 'results', 'err_msg', 'context', 'is_active']
 
-@receiver(perform_notification_scan)  # tie into the background_check management command execution
-def poll_and_execute_timers(**kwargs):  # pylint: disable=unused-argument
+# the timer columns which change when a callback fails, executed_at
+# has already been written before running the callbacks
+TIMER_FAILURE_FIELDS = ['err_msg', 'is_active']
+
+
+@lru_cache(maxsize=128)
+def _resolve_callback_class(class_name):
     """
-    Will look in our registry of timers and see which should be executed now. It is not
-    advised to call this method on any webservers that are serving HTTP traffic as
-    this can take an arbitrary amount of time
+    Returns the class at the passed in dotted path. Many timers share the same
+    callback class, so memoize this rather than importing it for each timer
     """
 
-    log.info('Starting poll_and_execute_timers()...')
-    store = notification_store()
+    module_path, _, name = class_name.rpartition('.')
+    return getattr(import_module(module_path), name)
 
-    timers_not_executed = store.get_all_active_timers()
 
-    for timer in timers_not_executed:
-        log.info('Executing timer: %s...', str(timer))
+def _execute_timer(timer, now):
+    """
+    Runs the callback for a single timer, and records the outcome (results,
+    rescheduling, errors) on the passed in timer. Nothing is persisted here.
+    'now' is the time of the current poll cycle
+    """
 
-        timer.executed_at = datetime.now(pytz.UTC)
-        store.save_notification_timer(timer)
+    log.info('Executing timer: %s...', str(timer))
 
-        try:
-            module_path, _, name = timer.class_name.rpartition('.')
-            log.info('Creating TimerCallback at class_name "%s"', timer.class_name)
+    try:
+        log.info('Creating TimerCallback at class_name "%s"', timer.class_name)
+
+        class_ = _resolve_callback_class(timer.class_name)
+        handler = class_()
+
+        results = handler.notification_timer_callback(timer)
+
+        # store the results in the database record for the timer. The
+        # handler hands over ownership of the dict, so no copy is needed,
+        # but make sure it can be written out. Otherwise this one timer
+        # would break the batched write for all of the others
+        DictField.to_json(results)
+        timer.results = results
+
+        # successful, see if we should reschedule
+        rerun_delta = results.get('reschedule_in_mins')
+        rerun_delta = rerun_delta if rerun_delta else timer.periodicity_min
 
-            class_ = getattr(import_module(module_path), name)
-            handler = class_()
+        if rerun_delta:
+            min_delta = const.NOTIFICATION_MINIMUM_PERIODICITY_MINS
+            rerun_delta = rerun_delta if rerun_delta >= min_delta else min_delta
 
-            results = handler.notification_timer_callback(timer)
+            timer.callback_at = timer.callback_at + timedelta(minutes=rerun_delta)
 
-            # store a copy of the results in the database record
-            # for the timer
-            timer.results = copy.deepcopy(results)
+            # is the rescheduling still in the past?
+            if timer.callback_at < now:
+                timer.callback_at = now + timedelta(minutes=rerun_delta)
 
-            # successful, see if we should reschedule
-            rerun_delta = results.get('reschedule_in_mins')
-            rerun_delta = rerun_delta if rerun_delta else timer.periodicity_min
+            timer.executed_at = None  # need to reset this or it won't get picked up again
 
-            if rerun_delta:
-                min_delta = const.NOTIFICATION_MINIMUM_PERIODICITY_MINS
-                rerun_delta = rerun_delta if rerun_delta >= min_delta else min_delta
+        if results.get('errors'):
+            timer.err_msg = str(results['errors'])
 
-                timer.callback_at = timer.callback_at + timedelta(minutes=rerun_delta)
+        # see if the callback returned a 'context_update'
+        # which means that we should persist this in
+        # the timer context
+        if 'context_update' in results:
+            context = dict(timer.context)
+            context.update(results['context_update'])
+            DictField.to_json(context)
+            timer.context = context
+    except Exception as ex:  # pylint: disable=broad-except
+        # generic error (possibly couldn't create class_name instance?)
+        timer.err_msg = str(ex)
+        timer.is_active = False
 
-                # is the rescheduling still in the past?
-                if timer.callback_at < datetime.now(pytz.UTC):
-                    timer.callback_at = datetime.now(pytz.UTC) + timedelta(minutes=rerun_delta)
+        log.exception(ex)
 
-                timer.executed_at = None  # need to reset this or it won't get picked up again
 
-            if results.get('errors'):
-                timer.err_msg = str(results['errors'])
+def _execute_timer_in_worker(timer, now):
+    """
+    Wrapper around _execute_timer() for use in a worker thread
+    """
+
+    try:
+        _execute_timer(timer, now)
+    finally:
+        # Django database connections are per thread, so clean up any
+        # connection the callback used in this worker once it is past
+        # CONN_MAX_AGE (or broken), just like Django does per request
+        close_old_connections()
+
+
+def _execute_timers(store, timers, now):
+    """
+    Runs a batch of timers, batching up all of the bookkeeping writes
+    """
+
+    # mark all of the timers as being executed up front, in one round trip
+    for timer in timers:
+        timer.executed_at = now
+    store.bulk_update_notification_timers(timers, ['executed_at'])
+
+    # the callbacks are typically I/O bound (sending email, bulk database
+    # writes), so optionally run them concurrently
+    if const.NOTIFICATION_TIMER_WORKERS > 1 and len(timers) > 1:
+        with ThreadPoolExecutor(max_workers=const.NOTIFICATION_TIMER_WORKERS) as executor:
+            list(executor.map(_execute_timer_in_worker, timers, [now] * len(timers)))
+    else:
+        for timer in timers:
+            _execute_timer(timer, now)
+
+    # persist the outcome of all of the timers we just ran. Failed timers just
+    # get disabled, and when a whole class of timers breaks (e.g. a bad
+    # handler import) they all share the same error, which can then be
+    # written as a single plain UPDATE
+    succeeded = [timer for timer in timers if timer.is_active]
+    failed = [timer for timer in timers if not timer.is_active]
+
+    try:
+        store.bulk_update_notification_timers(succeeded, TIMER_STATE_FIELDS)
+    except Exception as ex:  # pylint: disable=broad-except
+        # don't let one bad timer keep the rest of the batch from being
+        # rescheduled, fall back to writing them one by one
+        log.exception(ex)
+        for timer in succeeded:
+            try:
+                store.bulk_update_notification_timers([timer], TIMER_STATE_FIELDS)
+            except Exception as timer_ex:  # pylint: disable=broad-except
+                timer.err_msg = str(timer_ex)
+                timer.is_active = False
+                failed.append(timer)
+
+                log.exception(timer_ex)
+
+    store.bulk_update_notification_timers(failed, TIMER_FAILURE_FIELDS)
+
+
+@receiver(perform_notification_scan)  # tie into the background_check management command execution
+def poll_and_execute_timers(**kwargs):  # pylint: disable=unused-argument
+    """
+    Will look in our registry of timers and see which should be executed now. It is not
+    advised to call this method on any webservers that are serving HTTP traffic as
+    this can take an arbitrary amount of time
+    """
+
+    log.info('Starting poll_and_execute_timers()...')
+    store = notification_store()
 
-            # see if the callback returned a 'context_update'
-            # which means that we should persist this in
-            # the timer context
-            if 'context_update' in results:
-                timer.context.update(results['context_update'])
+    # take the time once for the whole poll cycle
+    now = datetime.now(pytz.UTC)
 
-            store.save_notification_timer(timer)
-        except Exception as ex:  # pylint: disable=broad-except
-            # generic error (possibly couldn't create class_name instance?)
-            timer.err_msg = str(ex)
-            timer.is_active = False
-            store.save_notification_timer(timer)
+    # stream through the expired timers, running them in fixed size
+    # batches so that memory use stays flat regardless of the backlog
+    batch = []
+    for timer in store.get_all_active_timers(until_time=now):
+        batch.append(timer)
+        if len(batch) == const.NOTIFICATION_TIMER_FETCH_CHUNK_SIZE:
+            _execute_timers(store, batch, now)
+            batch = []
 
-            log.exception(ex)
+    if batch:
+        _execute_timers(store, batch, now)
 
     log.info('Ending poll_and_execute_timers()...')
 
@@ -60,5 +60,9 @@ setup(
     dependency_links=[
     ],
     install_requires=load_requirements('requirements/base.txt'),
+    extras_require={
+        # faster JSON (de)serialization of the dict columns
+        'orjson': ['orjson'],
+    },
     tests_require=load_requirements('requirements/testing.txt')
 )